@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, ConfigDict
 from typing import Optional, Dict
-import json, os, traceback
+import json, os, traceback, asyncio
 from pathlib import Path
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
@@ -9,6 +9,11 @@ from supabase import create_client
 load_dotenv()
 MEMORY_FILE = Path(os.getenv("MEMORY_FILE", "memory.json"))
 ai = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
+MEMORY_TOKEN_THRESHOLD = int(os.getenv("MEMORY_TOKEN_THRESHOLD", 1500))
+MEMORY_IDLE_SECONDS = float(os.getenv("MEMORY_IDLE_SECONDS", 300))
+# Reaching this many pending messages also starts an update; past it, messages are only dropped
+# while updates are failing or one is already running, so a failing endpoint can't grow the prompt forever
+MEMORY_MAX_PENDING = int(os.getenv("MEMORY_MAX_PENDING", 500))
 SYSTEM_PROMPT = ""
 with open(os.getenv("MEMORY_PROMPT"), encoding="utf-8") as f:
 	SYSTEM_PROMPT = f.read()
@@ -100,7 +105,7 @@ async def update_memory_bank(recent_messages: list, current_memory: MemoryBank,
 	recent_messages = list(recent_messages or [])
 
 	formatted_messages = "\n".join(
-		f"{m['name']} (ID: {m['id']}): {m['content']}" 
+		f"{m['name']} (ID: {m['a_id']}): {m['content']}" 
 		for m in recent_messages
 	)
 
@@ -201,6 +206,109 @@ async def background_memory_update(messages, bot_user_id: str):
 		raise
 	return updated_memory
 
+def estimate_tokens(message: dict) -> int:
+	"""
+	Rough token count for a short-term memory message (~4 characters per token).
+	"""
+	return (len(message.get("name") or "") + len(str(message.get("content") or ""))) // 4 + 4
+
+class MemorySession:
+	"""
+	Checkpoint of the messages in one channel that haven't made it into the memory bank yet.
+	An update only sends what arrived since the last successful run, and is started once
+	enough new tokens or messages have piled up or the channel has been quiet for a while.
+	After a failed update, only the idle timer retries until an update succeeds again.
+	"""
+	def __init__(self, bot_user_id: str, token_threshold: int = MEMORY_TOKEN_THRESHOLD, idle_seconds: float = MEMORY_IDLE_SECONDS, max_pending: int = MEMORY_MAX_PENDING):
+		self.bot_user_id = bot_user_id
+		self.token_threshold = token_threshold
+		self.idle_seconds = idle_seconds
+		self.max_pending = max_pending
+		self.pending: list[dict] = []
+		self.failed = False
+		self._task: Optional[asyncio.Task] = None
+		self._idle: Optional[asyncio.Task] = None
+
+	def add(self, message: dict):
+		self.pending.append(message)
+		if len(self.pending) >= self.max_pending and not self.failed:
+			self._cancel_idle()
+			self.flush()
+		if len(self.pending) > self.max_pending:
+			dropped = len(self.pending) - self.max_pending
+			del self.pending[:dropped]
+			print(f"Memory update backlog full, dropped {dropped} oldest message(s)")
+
+	def pending_tokens(self) -> int:
+		# Counted on demand since messages can still be edited after being added (e.g. image descriptions)
+		return sum(estimate_tokens(m) for m in self.pending)
+
+	def poke(self):
+		"""
+		Call after each turn. Starts an update if enough new tokens or messages are pending, otherwise (re)arms the idle timer.
+		"""
+		if self.failed:
+			# Backing off: leave the retry timer from the failure running rather than restarting it
+			if self.pending and not (self._idle and not self._idle.done()):
+				self._arm_idle()
+		elif self.pending_tokens() >= self.token_threshold or len(self.pending) >= self.max_pending:
+			self._cancel_idle()
+			self.flush()
+		elif self.pending:
+			self._arm_idle()
+
+	def _cancel_idle(self):
+		if self._idle and not self._idle.done():
+			self._idle.cancel()
+
+	def _arm_idle(self):
+		self._cancel_idle()
+		self._idle = asyncio.create_task(self._idle_flush())
+
+	async def _idle_flush(self):
+		await asyncio.sleep(self.idle_seconds)
+		self.flush()
+
+	def flush(self) -> Optional[asyncio.Task]:
+		"""
+		Start an update with everything pending, unless one is already running.
+		"""
+		if self._task and not self._task.done():
+			return self._task
+		if not self.pending:
+			return None
+		self._task = asyncio.create_task(self._run(list(self.pending)))
+		self._task.add_done_callback(self._done)
+		return self._task
+
+	async def _run(self, batch: list[dict]) -> MemoryBank:
+		updated_memory = await background_memory_update(batch, self.bot_user_id)
+		# Only advance the checkpoint once the update is saved; anything that arrived meanwhile stays pending.
+		# Matched by identity since the backlog cap may have trimmed the front of the list in the meantime.
+		saved = {id(m) for m in batch}
+		self.pending[:] = [m for m in self.pending if id(m) not in saved]
+		return updated_memory
+
+	def _done(self, task: asyncio.Task):
+		print()
+		try:
+			exc = task.exception()
+		except asyncio.CancelledError:
+			print("Memory update was cancelled")
+			return
+		except Exception as e:
+			print("Memory update callback error:", repr(e))
+			return
+		if exc:
+			# Keep the batch pending and retry once things go quiet instead of hammering a failing endpoint
+			print(f"Memory update error: {repr(exc)}")
+			self.failed = True
+			self._arm_idle()
+		else:
+			print("Updated memory")
+			self.failed = False
+			self.poke()
+
 def format_memory_naturally(memory: MemoryBank) -> str:
 	parts = []
 	
@@ -0,0 +1,120 @@
+from contextvars import ContextVar
+from typing import Optional
+import json, os, time, hashlib, secrets, inspect, setenv
+import discord
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+_file = None
+# Secret salt so hashed user IDs can't be reversed. It is kept in .env so the same user keeps the same
+# hash across restarts appending to one trace; change TRACE_SALT to start a fresh anonymity domain.
+_salt = bytes.fromhex(os.getenv("TRACE_SALT") or "")
+if TRACE_FILE and not _salt:
+	_salt = secrets.token_bytes(16)
+	setenv.set_value("TRACE_SALT", _salt.hex())
+_turn: ContextVar[Optional[dict]] = ContextVar("trace_turn", default=None)
+
+def enabled() -> bool:
+	return bool(TRACE_FILE)
+
+def anonymize(user_id: int) -> str:
+	return hashlib.blake2b(str(user_id).encode(), key=_salt, digest_size=6).hexdigest()
+
+def content_size(content) -> int:
+	"""
+	Character count of a chat completion message content, either plain text or a list of parts.
+	"""
+	if isinstance(content, str):
+		return len(content)
+	if isinstance(content, list):
+		return sum(len(part.get("text") or "") for part in content if isinstance(part, dict))
+	return 0
+
+def start_turn(message: discord.Message):
+	"""
+	Start recording a turn for an incoming message. Only sizes and timings are kept, never content.
+	"""
+	if not enabled():
+		return
+	_turn.set({
+		# Wall-clock arrival, so traces stay ordered across restarts appending to the same file
+		"at": round(time.time(), 3),
+		"author": anonymize(message.author.id),
+		"chars": len(message.content),
+		"attachments": [{"type": att.content_type or "", "size": att.size} for att in message.attachments],
+		"llm": [],
+		"tools": [],
+		"_start": time.perf_counter(),
+	})
+
+async def llm(kind: str, call, messages: list = None):
+	"""
+	Await an LLM call and record its latency and prompt/response sizes on the current turn.
+	"""
+	turn = _turn.get()
+	if turn is None:
+		return await call
+	started = time.perf_counter()
+	resp = await call
+	choices = getattr(resp, "choices", None)
+	turn["llm"].append({
+		"kind": kind,
+		"ms": round((time.perf_counter() - started) * 1000),
+		"in": sum(content_size(m.get("content")) for m in messages or []),
+		"out": len(choices[0].message.content or "") if choices else 0,
+	})
+	return resp
+
+async def tool(name: str, func, args: list):
+	"""
+	Call a tool function, awaiting it if needed, and record its latency, result size and any error on the current turn.
+	"""
+	turn = _turn.get()
+	started = time.perf_counter()
+	result = None
+	error = None
+	try:
+		result = func(*args)
+		if inspect.isawaitable(result):
+			result = await result
+		return result
+	except Exception as e:
+		error = e
+		raise
+	finally:
+		if turn is not None:
+			event = {
+				"name": name,
+				"ms": round((time.perf_counter() - started) * 1000),
+				"args": sum(len(arg) for arg in args),
+				"out": len(str(result)) if result is not None else 0,
+			}
+			if error is not None:
+				event["error"] = type(error).__name__
+			turn["tools"].append(event)
+
+def finish_turn(reply: Optional[str], error: Optional[BaseException] = None):
+	"""
+	Write the current turn to TRACE_FILE as a single compact JSON line.
+	"""
+	global _file
+	turn = _turn.get()
+	if turn is None:
+		return
+	_turn.set(None)
+
+	turn["ms"] = round((time.perf_counter() - turn.pop("_start")) * 1000)
+	turn["reply"] = len(reply or "")
+	if error is not None:
+		turn["error"] = type(error).__name__
+
+	try:
+		if _file is None:
+			_file = open(TRACE_FILE, "a", encoding="utf-8")
+		_file.write(json.dumps(turn, separators=(",", ":")) + "\n")
+		_file.flush()
+	except Exception as e:
+		print("Trace write failed:", repr(e))
@@ -1,9 +1,10 @@
-import os, sys, discord, asyncio, uptime, setenv, re, time, inspect
+import os, sys, discord, asyncio, uptime, setenv, re, time
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 from collections import deque
-from algorithm_memory import load_memory, background_memory_update, format_memory_naturally
+from algorithm_memory import load_memory, format_memory_naturally, MemorySession
 import algorithm_tool as tools
+import algorithm_trace as trace
 from discord.ext import commands
 
 load_dotenv()
@@ -12,6 +13,7 @@ if not DISCORD_TOKEN:
 	raise SystemExit("DISCORD_TOKEN not set")
 
 GUILD_ID = int(os.getenv("GUILD_ID")) if os.getenv("GUILD_ID") else None
+CHANNEL_IDS = [1428968893111865384]
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -22,8 +24,7 @@ ai = AsyncOpenAI(api_key=os.getenv("API_KEY"), base_url="https://api.llm7.io/v1"
 serkan = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
 SHORT_TERM = int(os.getenv("SHORT_TERM_WINDOW", 50))
 short_term_memory: deque[dict] = deque(maxlen=SHORT_TERM)
-message_counter = 0
-UPDATE_FREQUENCY = int(os.getenv("UPDATE_FREQUENCY", 20))
+memory_sessions: dict[int, MemorySession] = {}
 
 SYSTEM_PROMPT = ""
 with open(os.getenv("PROMPT_FILE")) as f:
@@ -70,22 +71,32 @@ async def describe_image(message: discord.Message):
 			images.append(att)
 	
 	if images:
-		resp = await serkan.chat.completions.create(
+		messages = [
+			{"role": "system", "content": "Describe the attached image(s) objectively and thoroughly. Format: [Brief summary in one sentence], then detailed description of visual elements. Do not ask questions or offer help."},
+			{"role": "user", "content": [
+				{"type": "text", "text": "Describe these images in detail."},
+				*[{"type": "image_url", "image_url": {"url": att.url}} for att in images]
+			]}
+		]
+		resp = await trace.llm("describe", serkan.chat.completions.create(
 			model="gpt-5-nano",
-			messages=[
-				{"role": "system", "content": "Describe the attached image(s) objectively and thoroughly. Format: [Brief summary in one sentence], then detailed description of visual elements. Do not ask questions or offer help."},
-				{"role": "user", "content": [
-					{"type": "text", "text": "Describe these images in detail."},
-					*[{"type": "image_url", "image_url": {"url": att.url}} for att in images]
-				]}
-			]
-		)
+			messages=messages
+		), messages)
 		return resp
 	return ""
 
 def create_message(msg: discord.Message):
 	return {"name": msg.author.name, "a_id": msg.author.id, "content": msg.content, "attachments": msg.attachments, "time": int(msg.created_at.timestamp())}
 
+def remember(msg: dict, channel: discord.TextChannel):
+	"""
+	Add a message to short-term memory and to the channel's pending memory update.
+	"""
+	short_term_memory.append(msg)
+	if channel.id not in memory_sessions:
+		memory_sessions[channel.id] = MemorySession(bot.user.id)
+	memory_sessions[channel.id].add(msg)
+
 async def ask(content: str, memory: str, channel: discord.TextChannel, max_depth: int = 5) -> str:
 	"""
 	Recursively execute tool calls until Algorithm stops requesting tools or max depth reached.
@@ -108,42 +119,37 @@ async def ask(content: str, memory: str, channel: discord.TextChannel, max_depth
 	if content_before_call.strip():
 		await channel.send(content_before_call)
 	
-	short_term_memory.append({
+	remember({
 		"name": "The Algorithm",
 		"a_id": bot.user.id,
 		"content": content,
 		"attachments": [],
 		"time": time.time()
-	})
+	}, channel)
 	
 	if name in functions:
 		try:
-			if args:
-				tool_result = functions[name]["function"](*args.split(","))
-			else:
-				tool_result = functions[name]["function"]()
-			if inspect.isawaitable(tool_result):
-				tool_result = await tool_result
+			tool_result = await trace.tool(name, functions[name]["function"], args.split(",") if args else [])
 		except Exception as e:
 			tool_result = f"Error: {str(e)}"
 		
 		if tool_result == "system:_none":
 			return
 
-		short_term_memory.append({
+		remember({
 			"name": "system:tool_call",
 			"a_id": 0,
 			"content": tool_result,
 			"attachments": [],
 			"time": time.time()
-		})
+		}, channel)
 		
 		data = await get_messages(memory)
-		resp = await ai.chat.completions.create(
+		resp = await trace.llm("chat", ai.chat.completions.create(
 			model="gpt-5-chat",
 			messages=data["messages"],
 			temperature=1.2
-		)
+		), data["messages"])
 		new_content = resp.choices[0].message.content
 		print(f"AI (after {name}): {new_content}")
 		
@@ -167,12 +173,12 @@ async def on_ready():
 
 @bot.event
 async def on_message(message: discord.Message):
-	global message_counter
-	if message.author.bot or message.author == bot.user or message.channel.id not in [1428968893111865384]:
+	if message.author.bot or message.author == bot.user or message.channel.id not in CHANNEL_IDS:
 		return
 
+	trace.start_turn(message)
 	try:
-		short_term_memory.append(create_message(message))
+		remember(create_message(message), message.channel)
 		memory = format_memory_naturally(load_memory())
 		print(f"\n{message.author.name}: {message.content}")
 		data = await get_messages(memory)
@@ -181,17 +187,17 @@ async def on_message(message: discord.Message):
 		async with message.channel.typing():
 			if data["serkan"]:
 				resp, desc = await asyncio.gather(
-					serkan.chat.completions.create(model="gpt-5-nano", messages=data["messages"]),
+					trace.llm("chat", serkan.chat.completions.create(model="gpt-5-nano", messages=data["messages"]), data["messages"]),
 					describe_image(message)
 				)
 				short_term_memory[-1]['attachments'] = []
 				short_term_memory[-1]['content'] += f"\nAttached images:\n{desc.choices[0].message.content}"
 			else:
-				resp = await ai.chat.completions.create(
+				resp = await trace.llm("chat", ai.chat.completions.create(
 					model="gpt-5-chat",
 					messages=data["messages"],
 					temperature=1.2
-				)
+				), data["messages"])
 		
 		content = resp.choices[0].message.content
 		print("AI: " + content)
@@ -201,33 +207,17 @@ async def on_message(message: discord.Message):
 
 		# Send final message
 		sent_message = await message.channel.send(final_content)
-		short_term_memory.append(create_message(sent_message))
-		
-		message_counter += 1
-		# schedule memory update
-		if message_counter >= UPDATE_FREQUENCY:
-			message_counter = 0
-			task = asyncio.create_task(background_memory_update(list(short_term_memory)[-SHORT_TERM:], bot.user.id))
-
-			def _mem_done(t):
-				print()
-				try:
-					exc = t.exception()
-				except asyncio.CancelledError:
-					print("Memory update was cancelled")
-					return
-				except Exception as e:
-					print("Memory update callback error:", repr(e))
-					return
-				if exc:
-					print(f"Memory update error: {repr(exc)}")
-				else:
-					print("Updated memory")
-
-			task.add_done_callback(_mem_done)
+		remember(create_message(sent_message), message.channel)
+		trace.finish_turn(final_content)
 		
 	except Exception as e:
+		trace.finish_turn(None, e)
 		raise
+	finally:
+		# schedule memory update once enough new tokens pile up or the channel goes quiet,
+		# even if this turn failed part way through
+		if message.channel.id in memory_sessions:
+			memory_sessions[message.channel.id].poke()
 
 @bot.tree.command(name="ping", description="Get latency.")
 async def ping(interaction: discord.Interaction):
@@ -0,0 +1,319 @@
+"""
+Replay turn traces recorded with TRACE_FILE through the bot, against local stubs for Discord,
+the LLM endpoints and the tools, and report how it holds up as concurrency increases.
+
+Arrival times are compressed by --speed, while LLM, tool and Discord latencies play back at their
+recorded speed, so turns overlap more as speed and concurrency go up. Each concurrency level
+replays that many copies of the trace at once, as different users in the same channel.
+
+The real tool functions run, with only their HTTP targets stubbed: requests.get blocks for the
+recorded tool latency and returns a body of the recorded result size. Sync tools therefore still
+block the event loop (and search still parses on it) just like in production. Tools that only talk
+to Discord use the stubbed Discord latency; kys and tools missing from algorithm_tool are stubbed.
+
+Usage: python replay.py trace.jsonl --speed 10 --concurrency 1,4,16
+"""
+import argparse, asyncio, contextlib, gc, inspect, json, os, resource, tempfile, time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from dotenv import load_dotenv
+
+# Keep the bot off real services before any of its modules read the environment
+load_dotenv()
+os.environ.setdefault("DISCORD_TOKEN", "replay")
+os.environ.setdefault("PROMPT_FILE", "system_prompt.txt")
+os.environ.setdefault("MEMORY_PROMPT", "memory_prompt.txt")
+os.environ["API_KEY"] = os.environ["OPENAI_KEY"] = "replay"
+os.environ["SUPABASE_URL"] = os.environ["SUPABASE_KEY"] = ""
+os.environ["TRACE_FILE"] = ""
+os.environ["MEMORY_FILE"] = os.path.join(tempfile.mkdtemp(), "memory.json")
+
+import main, algorithm_memory
+import algorithm_tool as tools
+
+_turn: ContextVar["ReplayTurn"] = ContextVar("replay_turn")
+
+class FakeUser:
+	def __init__(self, id: int, name: str, bot: bool = False):
+		self.id = id
+		self.name = name
+		self.bot = bot
+
+class FakeAttachment:
+	def __init__(self, content_type: str, size: int):
+		self.content_type = content_type
+		self.size = size
+		self.url = f"https://replay.invalid/{size}"
+
+class FakeMessage:
+	def __init__(self, author: FakeUser, content: str, attachments: list, channel: "FakeChannel"):
+		self.author = author
+		self.content = content
+		self.attachments = attachments
+		self.channel = channel
+		self.created_at = datetime.now(timezone.utc)
+
+	async def add_reaction(self, reaction: str):
+		await asyncio.sleep(self.channel.latency)
+
+class FakeBot:
+	def __init__(self, latency: float):
+		self.guilds = []
+		self.latency = latency
+
+	async def change_presence(self, **kwargs):
+		await asyncio.sleep(self.latency)
+
+class FakeResponse:
+	def __init__(self, text: str):
+		self.text = text
+		self.status_code = 200
+
+	def raise_for_status(self):
+		pass
+
+def stub_http_get(url: str, **kwargs):
+	# Blocking on purpose: the real tools call requests.get synchronously on the event loop
+	event = _turn.get().tool_event or {"ms": 0, "out": 0}
+	time.sleep(event["ms"] / 1000)
+	return FakeResponse("y" * event["out"])
+
+class FakeChannel:
+	def __init__(self, latency: float):
+		self.id = main.CHANNEL_IDS[0]
+		self.latency = latency
+
+	def typing(self):
+		return contextlib.nullcontext()
+
+	async def send(self, content: str):
+		await asyncio.sleep(self.latency)
+		return FakeMessage(BOT_USER, content or "", [], self)
+
+BOT_USER = FakeUser(1, "The Algorithm", bot=True)
+
+class ReplayTurn:
+	"""
+	Plays back the LLM and tool calls recorded for one turn, in order, and tracks its timings.
+	"""
+	def __init__(self, data: dict, arrival: float):
+		self.data = data
+		self.arrival = arrival
+		self.first_request: float = None
+		self.finished: float = None
+		self.error = False
+		self._llm = {"chat": [e for e in data["llm"] if e["kind"] == "chat"], "describe": [e for e in data["llm"] if e["kind"] == "describe"]}
+		self._tools = list(data["tools"])
+		self._chats = 0
+		# The recorded event for the tool call currently running, read by the stubbed HTTP client
+		self.tool_event: dict = None
+
+	def next_llm(self, kind: str) -> dict:
+		if self.first_request is None:
+			self.first_request = time.perf_counter()
+		events = self._llm[kind]
+		return events.pop(0) if events else {"ms": 0, "out": 0}
+
+	def next_tool(self) -> dict:
+		return self._tools.pop(0) if self._tools else {"ms": 0, "out": 0}
+
+	async def chat(self) -> str:
+		event = self.next_llm("chat")
+		await asyncio.sleep(event["ms"] / 1000)
+		content = "x" * event["out"]
+		# The i-th chat response is what triggered the i-th tool call
+		if self._chats < len(self.data["tools"]):
+			called = self.data["tools"][self._chats]
+			content += f"\ncall {called['name']}"
+			if called["args"]:
+				# Split the recorded argument size across the tool's parameters so the real function accepts it
+				count = max(1, len(main.functions[called["name"]]["args"]))
+				content += " " + ",".join("a" * max(1, called["args"] // count) for _ in range(count))
+		self._chats += 1
+		return content
+
+def completion(content: str):
+	return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+class StubCompletions:
+	async def create(self, **kwargs):
+		return completion(await _turn.get().chat())
+
+class StubLLM:
+	def __init__(self):
+		self.chat = SimpleNamespace(completions=StubCompletions())
+
+async def stub_describe_image(message):
+	event = _turn.get().next_llm("describe")
+	await asyncio.sleep(event["ms"] / 1000)
+	return completion("z" * event["out"])
+
+def replay_tool(func, name: str):
+	"""
+	Wrap a tool so it picks up its recorded event, fails like the recording did, and otherwise runs
+	`func` (the real tool, or a stub) with the same sync/async shape as the original.
+	"""
+	if inspect.iscoroutinefunction(func):
+		async def run(*args):
+			event = _turn.get().next_tool()
+			_turn.get().tool_event = event
+			if "error" in event:
+				await asyncio.sleep(event["ms"] / 1000)
+				raise RuntimeError(f"replayed {event['error']}")
+			return await func(*args)
+	else:
+		def run(*args):
+			event = _turn.get().next_tool()
+			_turn.get().tool_event = event
+			if "error" in event:
+				time.sleep(event["ms"] / 1000)
+				raise RuntimeError(f"replayed {event['error']}")
+			return func(*args)
+	run.__name__ = name
+	return run
+
+def stub_tool(*args):
+	# Stand-in for tools that can't run here: blocks for the recorded latency like a sync tool
+	event = _turn.get().tool_event
+	time.sleep(event["ms"] / 1000)
+	return "y" * event["out"]
+
+def stub_memory_llm(latency: float):
+	async def parse(**kwargs):
+		await asyncio.sleep(latency)
+		return SimpleNamespace(output_parsed=algorithm_memory.load_memory())
+	return SimpleNamespace(responses=SimpleNamespace(parse=parse))
+
+def install_stubs(trace: list[dict], discord_latency: float, memory_latency: float):
+	main.bot._connection.user = BOT_USER
+	main.ai = main.serkan = StubLLM()
+	main.describe_image = stub_describe_image
+	algorithm_memory.ai = stub_memory_llm(memory_latency)
+	tools.current_bot = FakeBot(discord_latency)
+	tools.requests.get = stub_http_get
+
+	functions = {}
+	for name, info in tools.tools.items():
+		# kys would end the replay
+		functions[name] = {**info, "function": replay_tool(stub_tool if name == "kys" else info["function"], name)}
+	for turn in trace:
+		for called in turn["tools"]:
+			if called["name"] not in functions:
+				functions[called["name"]] = {"name": called["name"], "description": "", "args": {}, "function": replay_tool(stub_tool, called["name"])}
+	main.functions = functions
+
+def load_trace(path: str) -> list[dict]:
+	with open(path, encoding="utf-8") as f:
+		trace = [json.loads(line) for line in f if line.strip()]
+	# Turns are written when they finish, so overlapping turns can be out of arrival order
+	return sorted(trace, key=lambda turn: turn["at"])
+
+def memory_sample() -> tuple[float, int]:
+	"""
+	Current RSS in MiB and the number of live objects, taken only before and after a level so memory
+	measurement doesn't slow down the turns being timed (unlike tracemalloc).
+	"""
+	gc.collect()
+	try:
+		with open("/proc/self/statm") as f:
+			rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+	except OSError:
+		# No /proc outside Linux; peak RSS is the closest portable number
+		rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+	return rss, len(gc.get_objects())
+
+def percentile(values: list[float], q: float) -> float:
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run_turn(data: dict, arrival: float, author: FakeUser, channel: FakeChannel) -> ReplayTurn:
+	await asyncio.sleep(max(0, arrival - time.perf_counter()))
+	turn = ReplayTurn(data, arrival)
+	_turn.set(turn)
+	attachments = [FakeAttachment(att["type"], att["size"]) for att in data["attachments"]]
+	try:
+		await main.on_message(FakeMessage(author, "m" * data["chars"], attachments, channel))
+	except Exception:
+		turn.error = True
+	turn.finished = time.perf_counter()
+	return turn
+
+async def run_level(trace: list[dict], concurrency: int, speed: float, discord_latency: float) -> dict:
+	main.short_term_memory.clear()
+	main.memory_sessions.clear()
+	channel = FakeChannel(discord_latency)
+	start = time.perf_counter()
+	first_at = min(turn["at"] for turn in trace)
+
+	rss_before, objects_before = memory_sample()
+
+	jobs = []
+	for copy in range(concurrency):
+		for data in trace:
+			author = FakeUser(int(data["author"], 16) + (copy + 2) * 2**48, f"user-{copy}-{data['author']}")
+			jobs.append(run_turn(data, start + (data["at"] - first_at) / speed, author, channel))
+	turns = await asyncio.gather(*jobs)
+
+	rss_after, objects_after = memory_sample()
+	pending_memory = sum(len(s.pending) for s in main.memory_sessions.values())
+
+	# Drop idle timers and in-flight memory updates so they don't leak into the next level
+	leftover = asyncio.all_tasks() - {asyncio.current_task()}
+	for task in leftover:
+		task.cancel()
+	await asyncio.gather(*leftover, return_exceptions=True)
+	await asyncio.sleep(0)
+
+	queue = [((t.first_request or t.finished) - t.arrival) * 1000 for t in turns]
+	latency = [(t.finished - t.arrival) * 1000 for t in turns]
+	return {
+		"concurrency": concurrency,
+		"turns": len(turns),
+		"errors": sum(t.error for t in turns),
+		"queue_p50": percentile(queue, 0.5),
+		"queue_p95": percentile(queue, 0.95),
+		"e2e_p50": percentile(latency, 0.5),
+		"e2e_p95": percentile(latency, 0.95),
+		"rss_growth_mib": rss_after - rss_before,
+		"objects_growth": objects_after - objects_before,
+		"pending_memory": pending_memory,
+		# ru_maxrss is in KiB on Linux
+		"max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+	}
+
+async def replay(trace: list[dict], levels: list[int], speed: float, discord_latency: float, memory_latency: float) -> list[dict]:
+	install_stubs(trace, discord_latency, memory_latency)
+	results = []
+	for concurrency in levels:
+		# The bot prints every prompt; keep that out of the report
+		with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+			results.append(await run_level(trace, concurrency, speed, discord_latency))
+		print_result(results[-1])
+	return results
+
+def print_result(r: dict):
+	print(
+		f"{r['concurrency']:>5} {r['turns']:>6} {r['errors']:>6}"
+		f" {r['queue_p50']:>9.1f} {r['queue_p95']:>9.1f}"
+		f" {r['e2e_p50']:>9.1f} {r['e2e_p95']:>9.1f}"
+		f" {r['rss_growth_mib']:>8.1f} {r['objects_growth']:>9} {r['pending_memory']:>8} {r['max_rss_mib']:>8.1f}"
+	)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Replay recorded turn traces against local stubs.")
+	parser.add_argument("trace", help="JSONL trace written with TRACE_FILE set")
+	parser.add_argument("--speed", type=float, default=1.0, help="compress arrival times by this factor")
+	parser.add_argument("--concurrency", default="1,2,4,8", help="comma-separated numbers of trace copies to replay at once")
+	parser.add_argument("--discord-latency", type=float, default=0.1, help="seconds per stubbed Discord API call")
+	parser.add_argument("--memory-latency", type=float, default=5.0, help="seconds per stubbed memory update LLM call")
+	args = parser.parse_args()
+
+	trace = load_trace(args.trace)
+	if not trace:
+		raise SystemExit("Trace is empty")
+
+	print(f"{'conc':>5} {'turns':>6} {'errors':>6} {'queue p50':>9} {'queue p95':>9} {'e2e p50':>9} {'e2e p95':>9} {'rss +MiB':>8} {'objects +':>9} {'pending':>8} {'peak MiB':>8}")
+	asyncio.run(replay(trace, [int(c) for c in args.concurrency.split(",")], args.speed, args.discord_latency, args.memory_latency))